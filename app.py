@@ -1,10 +1,14 @@
 import logging
 import argparse
 import sqlite3
-from flask import Flask, request, jsonify, render_template
-from ib_insync import IB, Forex, Stock, MarketOrder, LimitOrder, util
+import threading
+from quart import Quart, request, jsonify, render_template
+from ib_insync import IB, Forex, Stock, MarketOrder, LimitOrder, StopOrder, util
 from datetime import datetime
 import asyncio
+import collections
+import concurrent.futures
+import msgspec
 
 # --- 1. Setup Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,87 +17,254 @@ logger = logging.getLogger(__name__)
 # --- 2. Trade Journal Database (Your New Schema) ---
 DB_FILE = 'trade_state.db'
 
+# One persistent connection shared by every helper (opened in init_db).
+# All use of it goes through _DB_LOCK; it is re-entrant so a helper can call
+# another helper while holding it.
+_CONN = None
+_DB_LOCK = threading.RLock()
+# Async code hands journal writes to this single thread, so they are applied
+# in the order they were submitted (a trade's INSERT before its fills, fill
+# batches in arrival order).
+_JOURNAL_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+
+# Hot cache of the journal, keyed by symbol: the open trade (at most one per
+# symbol) and the most recently closed one. Loaded in init_db, then read and
+# updated only on the event loop (never under _DB_LOCK), so webhooks never
+# read the journal from disk or wait on a journal write.
+_ACTIVE = {}
+_LAST_CLOSED = {}
+
+# SQL text is kept constant so sqlite3's statement cache reuses the prepared
+# statements instead of re-parsing them on every call.
+SQL_LOG_NEW = '''
+    INSERT INTO trades (symbol, signal, position_size, entry_order_id, tp_price, tp_order_id, sl_price, sl_order_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+# A fill is an entry, TP or SL fill; one statement covers all three.
+SQL_UPDATE_FILL = '''
+    UPDATE trades SET
+        entry_price = CASE WHEN entry_order_id = :order_id THEN :fill_price ELSE entry_price END,
+        exit_price = CASE WHEN :order_id IN (tp_order_id, sl_order_id) THEN :fill_price ELSE exit_price END,
+        tp_hit = CASE WHEN tp_order_id = :order_id THEN 1 ELSE tp_hit END,
+        closed = CASE WHEN :order_id IN (tp_order_id, sl_order_id) THEN 1 ELSE closed END
+    WHERE closed = 0 AND (entry_order_id = :order_id OR tp_order_id = :order_id OR sl_order_id = :order_id)
+'''
+SQL_CLOSE_TRADE = "UPDATE trades SET closed = 1 WHERE id = ?"
+SQL_GET_TRADE = "SELECT * FROM trades WHERE id = ?"
+# Ordered by id so the newest row per symbol wins when filling the cache.
+SQL_LOAD_ACTIVE = "SELECT * FROM trades WHERE closed = 0 ORDER BY id"
+SQL_LOAD_LAST_CLOSED = "SELECT * FROM trades WHERE id IN (SELECT MAX(id) FROM trades WHERE closed = 1 GROUP BY symbol)"
+
+def _get_conn():
+    """Returns the shared journal connection, opening it on first use."""
+    if _CONN is None:
+        init_db()
+    return _CONN
+
 def init_db():
     """Initializes the database with the new trade journal schema."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trades (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            symbol TEXT NOT NULL,
-            signal TEXT NOT NULL,
-            position_size REAL NOT NULL,
-            entry_order_id INTEGER,
-            tp_order_id INTEGER,
-            entry_price REAL,
-            exit_price REAL,
-            tp_price REAL,
-            tp_hit BOOLEAN DEFAULT 0,
-            closed BOOLEAN DEFAULT 0,
-            sl_price REAL,
-            sl_order_id INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        _CONN.row_factory = sqlite3.Row
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute("PRAGMA synchronous=NORMAL")
+        _CONN.execute("PRAGMA temp_store=MEMORY")
+        _CONN.execute("PRAGMA busy_timeout=5000")
+        _CONN.execute("PRAGMA cache_size=-8000")
+    with _DB_LOCK:
+        _CONN.execute('''
+            CREATE TABLE IF NOT EXISTS trades (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                symbol TEXT NOT NULL,
+                signal TEXT NOT NULL,
+                position_size REAL NOT NULL,
+                entry_order_id INTEGER,
+                tp_order_id INTEGER,
+                entry_price REAL,
+                exit_price REAL,
+                tp_price REAL,
+                tp_hit BOOLEAN DEFAULT 0,
+                closed BOOLEAN DEFAULT 0,
+                sl_price REAL,
+                sl_order_id INTEGER
+            )
+        ''')
+        # Serve the per-symbol "latest open/closed trade" lookups and the
+        # fill lookups by order id from indexes instead of table scans.
+        _CONN.execute("CREATE INDEX IF NOT EXISTS idx_trades_sym_closed_id ON trades(symbol, closed, id DESC)")
+        _CONN.execute("CREATE INDEX IF NOT EXISTS idx_trades_entry_order_id ON trades(entry_order_id)")
+        _CONN.execute("CREATE INDEX IF NOT EXISTS idx_trades_tp_order_id ON trades(tp_order_id)")
+        _CONN.execute("CREATE INDEX IF NOT EXISTS idx_trades_sl_order_id ON trades(sl_order_id)")
+        _ACTIVE.clear()
+        _LAST_CLOSED.clear()
+        for row in _CONN.execute(SQL_LOAD_ACTIVE):
+            _ACTIVE[row['symbol']] = dict(row)
+        for row in _CONN.execute(SQL_LOAD_LAST_CLOSED):
+            _LAST_CLOSED[row['symbol']] = dict(row)
     logger.info("Trade Journal Database initialized.")
 
 # --- NEW DATABASE HELPER FUNCTIONS ---
 def log_new_trade(symbol, signal, size, entry_order_id, tp_price=None, tp_order_id=None, sl_price=None, sl_order_id=None):
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO trades (symbol, signal, position_size, entry_order_id, tp_price, tp_order_id, sl_price, sl_order_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (symbol, signal, size, entry_order_id, tp_price, tp_order_id, sl_price, sl_order_id))
-    conn.commit()
-    conn.close()
-
-def update_trade_on_fill(order_id, fill_price):
-    """Updates a trade with its entry or exit price when a fill occurs."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    # Check if it's an entry fill
-    cursor.execute("UPDATE trades SET entry_price = ? WHERE entry_order_id = ? AND closed = 0", (fill_price, order_id))
-    # Check if it's a TP fill
-    cursor.execute("UPDATE trades SET exit_price = ?, closed = 1, tp_hit = 1 WHERE tp_order_id = ? AND closed = 0", (fill_price, order_id))
-    conn.commit()
-    conn.close()
+    """Journals a new trade with its entry, TP and SL order ids in one transaction."""
+    conn = _get_conn()
+    with _DB_LOCK:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(SQL_LOG_NEW, (symbol, signal, size, entry_order_id, tp_price, tp_order_id, sl_price, sl_order_id))
+            trade = conn.execute(SQL_GET_TRADE, (cursor.lastrowid,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return dict(trade)
+
+def update_trades_on_fills(fills):
+    """Updates trades with their entry or exit prices for a batch of (order_id, fill_price) fills."""
+    conn = _get_conn()
+    with _DB_LOCK:
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(SQL_UPDATE_FILL, ({'order_id': order_id, 'fill_price': fill_price} for order_id, fill_price in fills))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
 
 def close_trade_in_db(trade_id):
     """Marks a trade as closed when closed by a manual signal."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE trades SET closed = 1 WHERE id = ?", (trade_id,))
-    conn.commit()
-    conn.close()
+    conn = _get_conn()
+    with _DB_LOCK:
+        conn.execute(SQL_CLOSE_TRADE, (trade_id,))
+
+# --- TRADE CACHE HELPERS (event loop only) ---
+def cache_new_trade(symbol, signal, size, entry_order_id, tp_price=None, tp_order_id=None, sl_price=None, sl_order_id=None):
+    """Caches a just-placed trade as active; id/timestamp are filled in once it is journaled."""
+    trade = {
+        'id': None, 'timestamp': None, 'symbol': symbol, 'signal': signal, 'position_size': size,
+        'entry_order_id': entry_order_id, 'tp_order_id': tp_order_id, 'entry_price': None, 'exit_price': None,
+        'tp_price': tp_price, 'tp_hit': 0, 'closed': 0, 'sl_price': sl_price, 'sl_order_id': sl_order_id,
+    }
+    _ACTIVE[symbol] = trade
+    return trade
+
+def apply_fill_to_cache(order_id, fill_price):
+    """Mirrors a fill into the active/last-closed cache ahead of the journal write."""
+    for sym, trade in list(_ACTIVE.items()):
+        if trade['entry_order_id'] == order_id:
+            trade['entry_price'] = fill_price
+        elif trade['tp_order_id'] == order_id:
+            trade.update(exit_price=fill_price, tp_hit=1, closed=1)
+            _LAST_CLOSED[sym] = _ACTIVE.pop(sym)
+        elif trade['sl_order_id'] == order_id:
+            trade.update(exit_price=fill_price, closed=1)
+            _LAST_CLOSED[sym] = _ACTIVE.pop(sym)
+
+def close_trade_in_cache(symbol):
+    """Moves a symbol's active trade to last-closed."""
+    trade = _ACTIVE.pop(symbol, None)
+    if trade is not None:
+        trade['closed'] = 1
+        _LAST_CLOSED[symbol] = trade
 
 def get_active_trade(symbol):
     """Finds the currently open trade for a symbol, if any."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM trades WHERE symbol = ? AND closed = 0 ORDER BY id DESC LIMIT 1", (symbol,))
-    trade = cursor.fetchone()
-    conn.close()
-    return dict(trade) if trade else None
+    return _ACTIVE.get(symbol)
 
 def get_last_closed_trade(symbol):
     """Finds the most recently closed trade for a symbol."""
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM trades WHERE symbol = ? AND closed = 1 ORDER BY id DESC LIMIT 1", (symbol,))
-    trade = cursor.fetchone()
-    conn.close()
-    return dict(trade) if trade else None
+    return _LAST_CLOSED.get(symbol)
+
+def run_journal_write(func, *args):
+    """Runs a journal write on the journal thread; returns an awaitable for its result."""
+    return asyncio.get_running_loop().run_in_executor(_JOURNAL_EXECUTOR, func, *args)
 
 
 # --- 3. Global Data & Main App ---
 dashboard_data = {'status': 'Initializing...', 'account': {}, 'positions': []}
 # (The old trade_log list is no longer needed, but we keep it for simple UI logging)
-trade_log_ui = [] 
+# Bounded so the dashboard log (and its render) doesn't grow without limit
+trade_log_ui = collections.deque(maxlen=500)
+
+# Signal side -> (entry action, exit action used for TP/SL and closing)
+_SIDES = {'buy': ('BUY', 'SELL'), 'sell': ('SELL', 'BUY')}
+
+def _optional_price(value):
+    """TP/SL as a float; a blank string (empty TradingView placeholder) means none."""
+    if isinstance(value, str):
+        return float(value) if value.strip() else None
+    return value
+
+class Signal(msgspec.Struct):
+    """A TradingView webhook payload."""
+    action: str
+    symbol: str
+    side: str | None = None
+    quantity: float | None = None
+    # str is accepted so a blank "" can mean "no TP/SL"; see _optional_price
+    tp: float | str | None = None
+    sl: float | str | None = None
+
+    def __post_init__(self):
+        self.action = self.action.lower()
+        if self.side is not None:
+            self.side = self.side.lower()
+        self.tp = _optional_price(self.tp)
+        self.sl = _optional_price(self.sl)
+        # Raised errors surface as msgspec.ValidationError, i.e. a 400
+        if self.action == 'open':
+            if self.side not in _SIDES:
+                raise ValueError(f"side must be one of {sorted(_SIDES)} for an open signal")
+            if self.quantity is None or self.quantity <= 0:
+                raise ValueError("a positive quantity is required for an open signal")
+
+# Lax mode so numeric fields sent as strings (e.g. "0.5") are still accepted
+_SIGNAL_DECODER = msgspec.json.Decoder(Signal, strict=False)
+
+# Bumped whenever dashboard_data or trade_log_ui changes; index() only
+# re-renders the page when it differs from the version it last rendered.
+_DASH_VERSION = 0
+_DASH_HTML = b''
+_DASH_HTML_VERSION = -1
+
+def _dashboard_changed():
+    global _DASH_VERSION
+    _DASH_VERSION += 1
+
+def _ts():
+    """Timestamp string used for UI log entries and dashboard status."""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _order_brief(trade):
+    """Small summary of an ib_insync Trade for the UI log (repr() walks the whole object)."""
+    return {'orderId': trade.order.orderId, 'permId': trade.order.permId, 'status': trade.orderStatus.status}
+
+def log_ui(symbol, action, details):
+    """Appends an entry to the dashboard's trade log."""
+    trade_log_ui.append({'timestamp': _ts(), 'symbol': symbol, 'action': action, 'details': details})
+    _dashboard_changed()
+
+_STRIP_SLASH = str.maketrans('', '', '/')
+
+def _normalize(symbol):
+    """Returns (journal/contract symbol, is_fx); pairs like 'EUR/USD' are forex."""
+    return symbol.strip().translate(_STRIP_SLASH).upper(), '/' in symbol
+
+# One lock per normalized symbol so concurrent signals for it run in order
+_SYMBOL_LOCKS = collections.defaultdict(asyncio.Lock)
+# Qualified contracts, keyed by normalized symbol
+_CONTRACTS = {}
+# Fills waiting to be journaled, flushed FILL_FLUSH_DELAY seconds after the first
+_FILL_BUF = []
+FILL_FLUSH_DELAY = 0.01
+# In-flight flush tasks
+_FLUSH_TASKS = set()
+# Working TP/SL trades placed by this process, keyed by orderId, for O(1)
+# cancels; entries are dropped once IBKR reports the order done
+_TRADES = {}
+# Account tags shown on the dashboard (UnrealizedPnL/RealizedPnL come from the reqPnL stream)
+ACCOUNT_TAGS = frozenset({'NetLiquidation', 'TotalCashValue', 'BuyingPower'})
 
 def main():
     # ... (Parser and args setup remains the same) ...
@@ -106,122 +277,168 @@ def main():
     args = parser.parse_args()
 
     init_db()
-    app = Flask(__name__)
+    app = Quart(__name__)
     ib = IB()
 
-    async def update_dashboard_data():
-        # ... (no changes needed here) ...
-        global dashboard_data
-        while ib.isConnected():
-            try:
-                account_values = ib.accountValues()
-                dashboard_data['account'] = {item.tag: item.value for item in account_values if item.tag in ['NetLiquidation', 'TotalCashValue', 'BuyingPower', 'UnrealizedPnL', 'RealizedPnL']}
-                positions = ib.positions()
-                dashboard_data['positions'] = [{'symbol': p.contract.localSymbol, 'position': p.position, 'avgCost': round(p.avgCost, 2)} for p in positions]
-                server_time = ib.reqCurrentTime()
-                dashboard_data['status'] = f"Data successfully updated at {server_time.strftime('%Y-%m-%d %H:%M:%S')}"
-                logger.info("Dashboard data refreshed.")
-            except Exception as e:
-                logger.error(f"Error refreshing dashboard data: {repr(e)}")
-                dashboard_data['status'] = f"Error refreshing data: {repr(e)}"
-            await asyncio.sleep(60)
+    # Dashboard is kept current from ib_insync's streaming events instead of
+    # re-pulling everything on a timer; handlers only touch what changed.
+    # Keyed by (account, conId) so one instrument held in two accounts stays two rows
+    positions_by_key = {}
+
+    def touch_dashboard(changed):
+        # Only a change to a shown value re-stamps the status and invalidates
+        # the rendered page, so the "updated at" time matches what is shown.
+        if changed:
+            dashboard_data['status'] = f"Data successfully updated at {_ts()}"
+            _dashboard_changed()
+
+    def onAccountValue(value):
+        if value.tag in ACCOUNT_TAGS:
+            account = dashboard_data['account']
+            changed = account.get(value.tag) != value.value
+            account[value.tag] = value.value
+            touch_dashboard(changed)
+
+    def position_entry(position):
+        return {'symbol': position.contract.localSymbol, 'position': position.position, 'avgCost': round(position.avgCost, 2)}
+
+    def onPosition(position):
+        key = (position.account, position.contract.conId)
+        if position.position:
+            entry = position_entry(position)
+            changed = positions_by_key.get(key) != entry
+            positions_by_key[key] = entry
+        else:
+            changed = positions_by_key.pop(key, None) is not None
+        if changed:
+            dashboard_data['positions'] = list(positions_by_key.values())
+        touch_dashboard(changed)
+
+    def onPnL(pnl):
+        account = dashboard_data['account']
+        changed = False
+        for tag, value in (('UnrealizedPnL', pnl.unrealizedPnL), ('RealizedPnL', pnl.realizedPnL)):
+            if not util.isNan(value) and account.get(tag) != str(value):
+                account[tag] = str(value)
+                changed = True
+        touch_dashboard(changed)
 
     # --- 4. Re-architected Core Trading Logic ---
-    def connect_ibkr():
+    async def connect_ibkr():
         if not ib.isConnected():
-            ib.connect(args.ib_host, args.ib_port, clientId=args.ib_client_id)
+            await ib.connectAsync(args.ib_host, args.ib_port, clientId=args.ib_client_id)
+
+    async def get_contract(sym: str, is_fx: bool):
+        """Returns the qualified contract for a normalized symbol, qualifying it with IBKR only once."""
+        contract = _CONTRACTS.get(sym)
+        if contract is None:
+            contract = Forex(sym) if is_fx else Stock(sym, 'SMART', 'USD')
+            if not await ib.qualifyContractsAsync(contract):
+                # Unknown or ambiguous: don't cache, so a later signal retries
+                raise ValueError(f"Could not qualify contract for {sym}")
+            _CONTRACTS[sym] = contract
+        return contract
 
     # ** The NEW `open_position` function using the trade journal **
-    def open_position(symbol: str, side: str, quantity: float, tp=None, sl=None):
-        connect_ibkr()
-        sym = symbol.replace('/', '').upper()
+    async def open_position(sym: str, is_fx: bool, side: str, quantity: float, tp=None, sl=None):
+        await connect_ibkr()
 
         # LOGIC 1: Avoid re-entry after TP
         last_closed = get_last_closed_trade(sym)
-        if last_closed and last_closed.get('tp_hit') and last_closed.get('signal') == side:
+        if last_closed and last_closed['tp_hit'] and last_closed['signal'] == side:
             message = f"Re-entry for '{side}' on {sym} is blocked due to recent TP."
             logger.warning(message)
-            trade_log_ui.append({'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'symbol': sym, 'action': "RE-ENTRY BLOCKED", 'details': message})
+            log_ui(sym, "RE-ENTRY BLOCKED", message)
             return
 
         # LOGIC 2: One trade at a time & Reversals
         active_trade = get_active_trade(sym)
         if active_trade:
-            if active_trade.get('signal') == side:
+            if active_trade['signal'] == side:
                 logger.info(f"Signal '{side}' is same as active trade for {sym}. No action taken.")
                 return
             else:
                 logger.info(f"Signal '{side}' is opposite of active trade for {sym}. Reversing.")
-                close_position(symbol) # This will close the active trade
-
-        # Place the new entry order
-        contract = Forex(sym) if '/' in symbol else Stock(sym, 'SMART', 'USD')
-        action = 'BUY' if side == 'buy' else 'SELL'
-        market_order_trade = ib.placeOrder(contract, MarketOrder(action, quantity))
-        entry_order_id = market_order_trade.order.orderId
-        trade_log_ui.append({'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'symbol': sym, 'action': f"Market Order ({action})", 'details': repr(market_order_trade)})
-        
-       # Place TP and get its ID
+                await close_position(sym, is_fx) # This will close the active trade
+
+        # Place the entry with TP/SL attached as a bracket: the children carry
+        # the entry's parentId, so IBKR activates them once the entry fills and
+        # treats them as one-cancels-other, shrinking the sibling on a partial
+        # fill. Only the last leg is transmitted, releasing the whole bracket.
+        contract = await get_contract(sym, is_fx)
+        action, exit_act = _SIDES[side]
+        entry_order = MarketOrder(action, quantity, transmit=not (tp or sl))
+        market_order_trade = ib.placeOrder(contract, entry_order)
+        entry_order_id = entry_order.orderId
+
+        # Place TP and get its ID
         tp_id = None
         if tp:
-            tp_price = float(tp)
-            exit_act = 'SELL' if side == 'buy' else 'BUY'
-            tp_order_trade = ib.placeOrder(contract, LimitOrder(exit_act, quantity, tp_price))
-            tp_id = tp_order_trade.order.orderId
-            trade_log_ui.append({
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'symbol': sym,
-                'action': f"Take Profit ({exit_act})",
-                'details': repr(tp_order_trade)
-            })
-
-        # Place SL and get its ID
+            tp_order = LimitOrder(exit_act, quantity, float(tp), parentId=entry_order_id, transmit=not sl)
+            tp_order_trade = ib.placeOrder(contract, tp_order)
+            tp_id = tp_order.orderId
+            _TRADES[tp_id] = tp_order_trade
+
+        # Place SL (a stop, so it only triggers once price trades through it) and get its ID
         sl_id = None
         if sl:
-            sl_price = float(sl)
-            sl_act = 'SELL' if side == 'buy' else 'BUY'
-            sl_order_trade = ib.placeOrder(contract, LimitOrder(sl_act, quantity, sl_price))
-            sl_id = sl_order_trade.order.orderId
-            trade_log_ui.append({
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'symbol': sym,
-                'action': f"Stop Loss ({sl_act})",
-                'details': repr(sl_order_trade)
-            })
+            sl_order = StopOrder(exit_act, quantity, float(sl), parentId=entry_order_id, transmit=True)
+            sl_order_trade = ib.placeOrder(contract, sl_order)
+            sl_id = sl_order.orderId
+            _TRADES[sl_id] = sl_order_trade
 
-        # Log the new trade with both TP and SL
-        log_new_trade(sym, side, quantity, entry_order_id, tp, tp_id, sl, sl_id)
+        # Cache the trade before awaiting the journal so fills that arrive
+        # meanwhile find it, then log entry, TP and SL ids in a single INSERT
+        trade = cache_new_trade(sym, side, quantity, entry_order_id, tp, tp_id, sl, sl_id)
+        row = await run_journal_write(log_new_trade, sym, side, quantity, entry_order_id, tp, tp_id, sl, sl_id)
+        trade.update(id=row['id'], timestamp=row['timestamp'])
 
+        log_ui(sym, f"Market Order ({action})", _order_brief(market_order_trade))
+        if tp_id is not None:
+            log_ui(sym, f"Take Profit ({exit_act})", _order_brief(tp_order_trade))
+        if sl_id is not None:
+            log_ui(sym, f"Stop Loss ({exit_act})", _order_brief(sl_order_trade))
+
+
+    def cancel_order(order_id, label):
+        """Cancels a working order by its orderId."""
+        trade = _TRADES.pop(order_id, None)
+        if trade is None:
+            # Placed before a restart: fall back to the open orders IBKR reported
+            trade = next((t for t in ib.openTrades() if t.order.orderId == order_id), None)
+        if trade is None:
+            logger.warning(f"{label} order {order_id} is not open; nothing to cancel.")
+            return
+        try:
+            ib.cancelOrder(trade.order)
+            logger.info(f"Cancelled {label} order {order_id}")
+        except Exception as e:
+            logger.warning(f"Failed to cancel {label} order {order_id}: {e}")
 
     # ** The NEW `close_position` function **
-    def close_position(symbol: str):
-        connect_ibkr()
-        sym = symbol.replace('/', '').upper()
+    async def close_position(sym: str, is_fx: bool):
+        await connect_ibkr()
         active_trade = get_active_trade(sym)
         if not active_trade:
             logger.info(f"No active trade found for {sym} to close by signal.")
             return
 
-        # Cancel TP order if exists
-        tp_order_id = active_trade.get('tp_order_id')
-        if tp_order_id:
-            try:
-                ib.cancelOrder(ib.orders()[tp_order_id])  # Or cancel by ID if needed
-                logger.info(f"Cancelled TP order {tp_order_id}")
-            except Exception as e:
-                logger.warning(f"Failed to cancel TP order {tp_order_id}: {e}")
+        # Cancel TP and SL orders if they exist (the closing market order isn't
+        # part of their bracket, so IBKR won't cancel them for us)
+        if active_trade['tp_order_id']:
+            cancel_order(active_trade['tp_order_id'], 'TP')
+        if active_trade['sl_order_id']:
+            cancel_order(active_trade['sl_order_id'], 'SL')
 
         # Close the position with a market order
-        side = active_trade.get('signal')
-        quantity = active_trade.get('position_size')
-        action_to_close = 'SELL' if side == 'buy' else 'BUY'
-        close_order_trade = ib.placeOrder(
-            Forex(sym) if '/' in symbol else Stock(sym, 'SMART', 'USD'),
-            MarketOrder(action_to_close, quantity)
-        )
+        side = active_trade['signal']
+        quantity = active_trade['position_size']
+        action_to_close = _SIDES[side][1]
+        close_order_trade = ib.placeOrder(await get_contract(sym, is_fx), MarketOrder(action_to_close, quantity))
 
-        close_trade_in_db(active_trade.get('id'))
-        trade_log_ui.append({'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'symbol': sym, 'action': f"Close by Signal ({action_to_close})", 'details': repr(close_order_trade)})
+        close_trade_in_cache(sym)
+        await run_journal_write(close_trade_in_db, active_trade['id'])
+        log_ui(sym, f"Close by Signal ({action_to_close})", _order_brief(close_order_trade))
 
     # --- 5. The Sentry & App Startup ---
     def onExecDetails(trade, fill):
@@ -229,22 +446,59 @@ def main():
         order_id = fill.execution.orderId
         fill_price = fill.execution.price
         logger.info(f"Fill detected for orderId {order_id} at price {fill_price}.")
-        update_trade_on_fill(order_id, fill_price)
+        # The cache is updated right away so the next webhook sees a TP/SL
+        # close; only the journal write is debounced. Fills often arrive in
+        # bursts (partial fills), so they are journaled together shortly after
+        # the first one instead of one transaction each.
+        apply_fill_to_cache(order_id, fill_price)
+        _FILL_BUF.append((order_id, fill_price))
+        if len(_FILL_BUF) == 1:
+            asyncio.get_running_loop().call_later(FILL_FLUSH_DELAY, start_flush)
+
+    def onOrderStatus(trade):
+        """Forgets TP/SL legs once IBKR reports them filled, cancelled or rejected."""
+        if trade.isDone():
+            _TRADES.pop(trade.order.orderId, None)
+
+    def start_flush():
+        # Keep a reference until the task finishes so it can't be garbage-collected mid-flight
+        task = asyncio.get_running_loop().create_task(flush_fills())
+        _FLUSH_TASKS.add(task)
+        task.add_done_callback(_FLUSH_TASKS.discard)
+
+    async def flush_fills():
+        fills = _FILL_BUF[:]
+        _FILL_BUF.clear()
+        try:
+            await run_journal_write(update_trades_on_fills, fills)
+        except Exception as e:
+            logger.error(f"Failed to journal fills {fills}: {e}", exc_info=True)
 
-    # Flask routes
+    # Quart routes (served on the same asyncio loop as the IB connection)
     @app.route('/')
-    def index():
-        return render_template('index.html', dashboard_data=dashboard_data, trade_log=trade_log_ui)
+    async def index():
+        global _DASH_HTML, _DASH_HTML_VERSION
+        version = _DASH_VERSION
+        if version != _DASH_HTML_VERSION:
+            html = await render_template('index.html', dashboard_data=dashboard_data, trade_log=trade_log_ui)
+            _DASH_HTML, _DASH_HTML_VERSION = html.encode(), version
+        return _DASH_HTML, 200, {'Content-Type': 'text/html; charset=utf-8', 'Cache-Control': 'max-age=1'}
     
     @app.route('/webhook', methods=['POST'])
-    def webhook():
-        data = request.get_json(force=True)
+    async def webhook():
+        try:
+            signal = _SIGNAL_DECODER.decode(await request.get_data())
+        except msgspec.DecodeError as e:
+            logger.warning(f'Rejected webhook payload: {e}')
+            return jsonify({'status': 'error', 'msg': str(e)}), 400
         try:
-            action = data.get('action')
-            if action == 'open':
-                open_position(data.get('symbol'), data.get('side'), data.get('quantity'), data.get('tp'), data.get('sl'))
-            elif action == 'close':
-                close_position(data.get('symbol'))
+            sym, is_fx = _normalize(signal.symbol)
+            # Journal writes now yield to the loop, so serialize signals per symbol
+            async with _SYMBOL_LOCKS[sym]:
+                if signal.action == 'open':
+                    await open_position(sym, is_fx, signal.side, signal.quantity, signal.tp, signal.sl)
+                elif signal.action == 'close':
+                    await close_position(sym, is_fx)
         except Exception as e:
             logger.error(f'Error processing webhook: {e}', exc_info=True)
             return jsonify({'status': 'error', 'msg': str(e)}), 500
@@ -252,13 +506,35 @@ def main():
 
     def onConnected(*args):
         logger.info("IBKR Connection successful.")
-        asyncio.create_task(update_dashboard_data())
-    
+        # Rebuild positions from the fresh sync so ones closed while we were
+        # disconnected don't linger on the dashboard
+        positions_by_key.clear()
+        for position in ib.positions():
+            if position.position:
+                positions_by_key[(position.account, position.contract.conId)] = position_entry(position)
+        dashboard_data['positions'] = list(positions_by_key.values())
+        touch_dashboard(True)
+        # Account values and positions stream in on their own; PnL needs a
+        # subscription. The dashboard shows a single PnL, so follow the
+        # first managed account only.
+        accounts = ib.managedAccounts()
+        if accounts:
+            ib.reqPnL(accounts[0])
+
     ib.execDetailsEvent += onExecDetails
+    ib.orderStatusEvent += onOrderStatus
+    ib.accountValueEvent += onAccountValue
+    ib.positionEvent += onPosition
+    ib.pnlEvent += onPnL
     ib.connectedEvent += onConnected
-    util.startLoop()
-    connect_ibkr()
-    app.run(host=args.flask_host, port=args.flask_port, debug=False)
+
+    # Quart (via hypercorn), ib_insync and the webhook handlers all share this
+    # one loop; blocking journal writes run on the journal thread.
+    async def serve():
+        await connect_ibkr()
+        await app.run_task(host=args.flask_host, port=args.flask_port, debug=False)
+
+    asyncio.run(serve())
 
 if __name__ == '__main__':
     main()
\ No newline at end of file